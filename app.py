@@ -1,5 +1,21 @@
 import os
+import io
 import sys
+import json
+import zlib
+import sqlite3
+import struct
+import base64
+import bisect
+import hashlib
+import tempfile
+import time
+import codecs
+import contextlib
+import multiprocessing
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import requests
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                              QPushButton, QLabel, QLineEdit, QFileDialog, QComboBox, 
@@ -8,29 +24,685 @@ from PyQt5.QtCore import Qt, QThread, pyqtSignal
 from PyQt5.QtGui import QIcon, QColor
 from fontTools.ttLib import TTFont
 from fontTools.subset import Subsetter, Options
+from fontTools.pens.recordingPen import DecomposingRecordingPen
+
+FONT_EXTENSIONS = (".ttf", ".otf", ".woff", ".woff2")
+
+def codepoints_to_mask(codepoints):
+    """Packs codepoints into an int bitmap (bit N set = U+N covered)"""
+    codepoints = list(codepoints)
+    if not codepoints:
+        return 0
+    bitmap = bytearray((max(codepoints) >> 3) + 1)
+    for cp in codepoints:
+        bitmap[cp >> 3] |= 1 << (cp & 7)
+    return int.from_bytes(bytes(bitmap), "little")
+
+def mask_to_codepoints(mask):
+    """Unpacks an int bitmap back into a sorted list of codepoints"""
+    codepoints = []
+    while mask:
+        lowest = mask & -mask
+        codepoints.append(lowest.bit_length() - 1)
+        mask ^= lowest
+    return codepoints
+
+def _scan_font_coverage(path, known_sha1=None):
+    """
+    Worker for FontCoverageIndex: reads one font's cmap.
+    Runs in a subprocess, so it must stay a module level function.
+    Returns (path, sha1, codepoint_count, compressed_bitmap or None, error).
+    """
+    try:
+        with open(path, "rb") as f:
+            sha1 = hashlib.sha1(f.read()).hexdigest()
+        if sha1 == known_sha1:
+            # Only the mtime changed, the stored bitmap is still valid
+            return path, sha1, None, None, None
+        font = TTFont(path, lazy=True)
+        cmap = font.getBestCmap() or {}
+        font.close()
+        mask = codepoints_to_mask(cmap.keys())
+        bitmap = mask.to_bytes((mask.bit_length() + 7) // 8, "little")
+        return path, sha1, len(cmap), zlib.compress(bitmap), None
+    except Exception as e:
+        return path, None, 0, None, str(e)
+
+class FontCoverageIndex:
+    """
+    Persistent codepoint coverage index for a font library.
+
+    Each font's cmap is stored as a zlib compressed bitmap in SQLite and is
+    rebuilt only when the file's mtime/size change and its content hash differs.
+    Queries run as big-int bit operations, so checking hundreds of fonts
+    against thousands of characters doesn't touch any font file.
+    """
+
+    def __init__(self, db_path=None):
+        if db_path is None:
+            db_path = os.path.join(os.path.expanduser("~"), ".font-thin", "coverage.db")
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # Decoded bitmaps, keyed by (path, sha1) so rebuilt fonts never hit a stale entry
+        self._mask_cache = {}
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS coverage (
+                    path TEXT PRIMARY KEY,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    sha1 TEXT NOT NULL,
+                    codepoint_count INTEGER NOT NULL,
+                    bitmap BLOB NOT NULL
+                )""")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # A fresh connection per call keeps the index usable from worker threads.
+        # Closed explicitly, Windows keeps the database file open until it's collected otherwise.
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def update(self, font_paths, max_workers=None):
+        """
+        Brings the index up to date for font_paths, reading stale fonts in parallel.
+        Returns (rebuilt_count, errors) where errors maps path -> message.
+        """
+        font_paths = [os.path.abspath(p) for p in font_paths]
+        with self._connect() as conn:
+            rows = {row[0]: row[1:] for row in conn.execute(
+                "SELECT path, mtime_ns, size, sha1 FROM coverage")}
+
+        stale = []
+        stats = {}
+        for path in font_paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stats[path] = (st.st_mtime_ns, st.st_size)
+            row = rows.get(path)
+            if row is None or (row[0], row[1]) != stats[path]:
+                stale.append((path, row[2] if row else None))
+
+        if not stale:
+            return 0, {}
+
+        if len(stale) == 1:
+            results = [_scan_font_coverage(*stale[0])]
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(_scan_font_coverage,
+                                            [s[0] for s in stale],
+                                            [s[1] for s in stale],
+                                            chunksize=8))
+
+        rebuilt = 0
+        errors = {}
+        with self._connect() as conn:
+            for path, sha1, count, bitmap, error in results:
+                mtime_ns, size = stats[path]
+                if error:
+                    errors[path] = error
+                    conn.execute("DELETE FROM coverage WHERE path = ?", (path,))
+                elif bitmap is None:
+                    conn.execute("UPDATE coverage SET mtime_ns = ?, size = ? WHERE path = ?",
+                                 (mtime_ns, size, path))
+                else:
+                    conn.execute("INSERT OR REPLACE INTO coverage VALUES (?, ?, ?, ?, ?, ?)",
+                                 (path, mtime_ns, size, sha1, count, bitmap))
+                    rebuilt += 1
+        return rebuilt, errors
+
+    def update_directory(self, directory, max_workers=None):
+        """Indexes every font file under directory and drops entries for deleted files"""
+        directory = os.path.abspath(directory)
+        font_paths = []
+        for root, dirs, files in os.walk(directory):
+            # Skip our own output folders, subsets aren't part of the library
+            dirs[:] = [d for d in dirs if d != "result"]
+            for name in files:
+                if name.lower().endswith(FONT_EXTENSIONS):
+                    font_paths.append(os.path.join(root, name))
+
+        prefix = os.path.join(directory, "")
+        with self._connect() as conn:
+            indexed = [row[0] for row in conn.execute(
+                "SELECT path FROM coverage WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))]
+            existing = set(font_paths)
+            conn.executemany("DELETE FROM coverage WHERE path = ?",
+                             [(p,) for p in indexed if p not in existing])
+        return self.update(font_paths, max_workers)
+
+    def _masks(self, font_paths=None):
+        """Yields (path, mask) for the requested fonts, or the whole index"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT path, sha1, bitmap FROM coverage").fetchall()
+        wanted = None if font_paths is None else {os.path.abspath(p) for p in font_paths}
+        for path, sha1, bitmap in rows:
+            if wanted is not None and path not in wanted:
+                continue
+            key = (path, sha1)
+            mask = self._mask_cache.get(key)
+            if mask is None:
+                mask = int.from_bytes(zlib.decompress(bitmap), "little")
+                self._mask_cache[key] = mask
+            yield path, mask
+
+    def fonts_covering(self, codepoints, font_paths=None):
+        """Returns the indexed fonts that contain every one of codepoints"""
+        needed = codepoints_to_mask(codepoints)
+        return sorted(path for path, mask in self._masks(font_paths) if needed & mask == needed)
+
+    def missing_codepoints(self, codepoints, font_paths=None):
+        """Returns {path: [missing codepoints]} for the indexed fonts"""
+        needed = codepoints_to_mask(codepoints)
+        return {path: mask_to_codepoints(needed & ~mask) for path, mask in self._masks(font_paths)}
+
+def format_codepoints(codepoints, limit=50):
+    """Formats codepoints for the log, e.g. '犇 骉 U+1F600 ... (共 120 个)'"""
+    shown = []
+    for cp in codepoints[:limit]:
+        char = chr(cp)
+        shown.append(char if char.isprintable() and not char.isspace() else f"U+{cp:04X}")
+    text = " ".join(shown)
+    if len(codepoints) > limit:
+        text += f" ... (共 {len(codepoints)} 个)"
+    return text
+
+def font_to_bytes(font, flavor=None):
+    """Serializes a TTFont, optionally as woff/woff2"""
+    font.flavor = flavor
+    # Keep head.modified from the source so identical input gives identical bytes (and hashes)
+    font.recalcTimestamp = False
+    buffer = io.BytesIO()
+    font.save(buffer)
+    return buffer.getvalue()
+
+def fingerprint_filename(logical_name, data):
+    """Inserts a content hash before the extension: Foo-subset.woff2 -> Foo-subset.1a2b3c4d.woff2"""
+    stem, ext = os.path.splitext(logical_name)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:8]}{ext}"
+
+# os.umask() can only be read by setting it, so read it once at import, before any threads start
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+# Mode a plain open() would give a new file: 0o666 minus the process umask
+NEW_FILE_MODE = 0o666 & ~_UMASK
+
+def write_atomic(path, data):
+    """
+    Writes data through a temp file and an atomic rename, so a crashed run
+    never leaves a half-written file. Returns False if the file already
+    held exactly these bytes and nothing was written.
+    """
+    try:
+        if os.path.getsize(path) == len(data):
+            with open(path, "rb") as f:
+                if f.read() == data:
+                    return False
+    except OSError:
+        pass
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except OSError:
+        mode = NEW_FILE_MODE
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file as 0600, which would survive the rename and the upload to a web server
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return True
+
+def format_size(size_bytes):
+    """Formats a byte count for display"""
+    if size_bytes < 1024:
+        return f"{size_bytes} 字节"
+    elif size_bytes < 1024 * 1024:
+        return f"{size_bytes/1024:.2f} KB"
+    else:
+        return f"{size_bytes/(1024*1024):.2f} MB"
+
+# @font-face src format() names
+FORMAT_TO_MIME = {
+    'TTF': 'truetype',
+    'OTF': 'opentype',
+    'WOFF': 'woff',
+    'WOFF2': 'woff2',
+    'SVG': 'svg',
+    'EOT': 'embedded-opentype'
+}
+
+# Browsers take the first src they support, so the smallest formats go first
+PREFERRED_FORMAT_ORDER = ["WOFF2", "WOFF", "TTF", "OTF"]
+
+def sort_by_preference(font_files):
+    return sorted(font_files, key=lambda f: PREFERRED_FORMAT_ORDER.index(f['format'])
+                  if f['format'] in PREFERRED_FORMAT_ORDER else len(PREFERRED_FORMAT_ORDER))
+
+def build_font_face(family, sources, display=None):
+    """Builds one @font-face rule; sources is a list of (url, format name) pairs"""
+    src = ",\n        ".join(f"url('{url}') format('{FORMAT_TO_MIME.get(fmt, 'truetype')}')"
+                             for url, fmt in sources)
+    display_rule = f"\n    font-display: {display};" if display else ""
+    return f"""
+@font-face {{
+    font-family: '{family}';
+    src: {src};
+    font-weight: normal;
+    font-style: normal;{display_rule}
+}}
+"""
+
+def subset_font(font_path, text, options=None):
+    """Loads font_path and subsets it to the characters in text"""
+    font = TTFont(font_path)
+    subsetter = Subsetter(options=options or Options())
+    subsetter.populate(text=text)
+    subsetter.subset(font)
+    return font
+
+def parse_character_sources(text):
+    """Splits the source field into URLs / file paths, separated by ';' or new lines"""
+    return [source.strip() for source in text.replace("\n", ";").split(";") if source.strip()]
+
+# Chunk size for streaming character sources
+SOURCE_CHUNK_SIZE = 64 * 1024
+
+def fetch_character_source(source):
+    """
+    Streams one URL or local file and counts its characters while decoding.
+    Returns (counts, byte_count, elapsed_seconds), byte_count being the bytes
+    actually transferred (before gzip decoding); raises on failure.
+    """
+    started = time.perf_counter()
+    counts = Counter()
+    byte_count = 0
+    if source.lower().startswith(("http://", "https://")):
+        with requests.get(source, timeout=10, stream=True) as response:
+            response.raise_for_status()
+            # requests guesses ISO-8859-1 for text/* without a charset, the lists are UTF-8
+            encoding = response.encoding if "charset" in response.headers.get("content-type", "") else "utf-8"
+            # A declared charset=utf-8 doesn't rule out a BOM, which would otherwise count as a character
+            if codecs.lookup(encoding).name == "utf-8":
+                encoding = "utf-8-sig"
+            chunks = response.iter_content(SOURCE_CHUNK_SIZE)
+            decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+            for chunk in chunks:
+                byte_count += len(chunk)
+                counts.update(decoder.decode(chunk))
+            # iter_content yields decompressed data; the raw stream knows what came over the wire
+            try:
+                byte_count = response.raw.tell()
+            except Exception:
+                pass
+    else:
+        decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(SOURCE_CHUNK_SIZE), b""):
+                byte_count += len(chunk)
+                counts.update(decoder.decode(chunk))
+    counts.update(decoder.decode(b"", final=True))
+    return counts, byte_count, time.perf_counter() - started
+
+def rank_characters(counts, by_frequency=False):
+    """
+    Returns the distinct non-whitespace characters of a Counter, ordered by first
+    appearance (an already ranked list) or by how often they occur (a corpus).
+    """
+    if by_frequency:
+        return "".join(c for c, _ in counts.most_common() if not c.isspace())
+    return "".join(c for c in counts if not c.isspace())
+
+def glyph_compiled_data(font, glyph_name):
+    """Compiled outline bytes of one glyph, taken as stored while the glyph is still packed"""
+    if "glyf" in font:
+        glyf = font["glyf"]
+        glyph = glyf.glyphs.get(glyph_name)
+        if glyph is None:
+            return b""
+        data = getattr(glyph, "data", None)
+        return data if data is not None else glyph.compile(glyf)
+    if "CFF " in font:
+        charstring = font["CFF "].cff.topDictIndex[0].CharStrings[glyph_name]
+        if getattr(charstring, "bytecode", None) is None:
+            charstring.compile()
+        return charstring.bytecode
+    return b""
+
+# Composite glyph component flags, see the OpenType glyf spec
+_ARG_1_AND_2_ARE_WORDS = 0x0001
+_WE_HAVE_A_SCALE = 0x0008
+_MORE_COMPONENTS = 0x0020
+_WE_HAVE_AN_X_AND_Y_SCALE = 0x0040
+_WE_HAVE_A_TWO_BY_TWO = 0x0080
+
+def _component_glyph_ids(data):
+    """Glyph ids referenced by a compiled glyf entry, empty unless it's a composite"""
+    if len(data) < 10 or struct.unpack(">h", data[:2])[0] >= 0:
+        return []
+    ids = []
+    offset = 10
+    flags = _MORE_COMPONENTS
+    while flags & _MORE_COMPONENTS:
+        flags, glyph_id = struct.unpack(">HH", data[offset:offset + 4])
+        ids.append(glyph_id)
+        offset += 4 + (4 if flags & _ARG_1_AND_2_ARE_WORDS else 2)
+        if flags & _WE_HAVE_A_SCALE:
+            offset += 2
+        elif flags & _WE_HAVE_AN_X_AND_Y_SCALE:
+            offset += 4
+        elif flags & _WE_HAVE_A_TWO_BY_TWO:
+            offset += 8
+    return ids
+
+def glyph_closure(font, glyph_name):
+    """
+    The glyph plus the components it references (TrueType composites). Components
+    are read from the compiled bytes, so the glyphs stay packed for glyph_compiled_data.
+    """
+    if "glyf" not in font:
+        return [glyph_name]
+    glyf = font["glyf"]
+    names = [glyph_name]
+    for name in names:
+        glyph = glyf.glyphs.get(name)
+        if glyph is None:
+            continue
+        data = getattr(glyph, "data", None)
+        if data is not None:
+            components = [font.getGlyphName(i) for i in _component_glyph_ids(data)]
+        elif glyph.isComposite():
+            components = glyph.getComponentNames(glyf)
+        else:
+            components = []
+        names.extend(c for c in components if c not in names)
+    return names
+
+# Rough per-entry cost besides the outline: hmtx (4 bytes) per glyph, cmap per codepoint
+GLYPH_OVERHEAD_BYTES = 4
+CODEPOINT_OVERHEAD_BYTES = 2
+
+# Size cap for the default critical subset, in estimated uncompressed glyph bytes;
+# the inlined WOFF2 comes out well below it even after base64
+CRITICAL_MAX_BYTES = 12 * 1024
+
+def pick_critical_chars(font, text, max_bytes=CRITICAL_MAX_BYTES):
+    """
+    Takes distinct, non-whitespace characters of text in order, stopping before
+    their glyphs (estimated from compiled sizes) would exceed max_bytes
+    """
+    cmap = font.getBestCmap() or {}
+    seen = {".notdef"}
+    size = 0
+    chars = []
+    for c in dict.fromkeys(c for c in text if not c.isspace()):
+        if ord(c) not in cmap:
+            continue
+        new_glyphs = [name for name in glyph_closure(font, cmap[ord(c)]) if name not in seen]
+        added = CODEPOINT_OVERHEAD_BYTES + sum(len(glyph_compiled_data(font, name)) + GLYPH_OVERHEAD_BYTES
+                                               for name in new_glyphs)
+        if size + added > max_bytes:
+            break
+        size += added
+        seen.update(new_glyphs)
+        chars.append(c)
+    return "".join(chars)
+
+def gsub_alternates(font, glyph_names, features):
+    """
+    Glyphs reachable from glyph_names through the single, alternate and ligature
+    substitutions of the given GSUB features. Lookups that only run from a
+    contextual rule are not followed, whether they fire depends on the context.
+    """
+    if "GSUB" not in font:
+        return set()
+    gsub = font["GSUB"].table
+    if not gsub.FeatureList or not gsub.LookupList:
+        return set()
+    lookups = gsub.LookupList.Lookup
+    
+    def subtables(index):
+        return [getattr(sub, "ExtSubTable", sub) for sub in lookups[index].SubTable]
+    
+    lookup_indices = set()
+    for record in gsub.FeatureList.FeatureRecord:
+        if record.FeatureTag in features:
+            lookup_indices.update(record.Feature.LookupListIndex)
+    
+    reached = set(glyph_names)
+    changed = True
+    while changed:
+        changed = False
+        for index in sorted(lookup_indices):
+            for sub in subtables(index):
+                found = set()
+                if hasattr(sub, "mapping"):
+                    found = {alt for glyph, alt in sub.mapping.items() if glyph in reached}
+                elif hasattr(sub, "alternates"):
+                    for glyph, alts in sub.alternates.items():
+                        if glyph in reached:
+                            found.update(alts)
+                elif hasattr(sub, "ligatures"):
+                    for first, ligatures in sub.ligatures.items():
+                        if first in reached:
+                            found.update(lig.LigGlyph for lig in ligatures
+                                         if all(c in reached for c in lig.Component))
+                if not found <= reached:
+                    reached |= found
+                    changed = True
+    return reached - set(glyph_names)
+
+# Per-process state for the verify workers: both fonts are loaded once by the initializer
+_verify_fonts = {}
+
+def _init_verify_worker(original_path, subset_data):
+    for key, font in (("original", TTFont(original_path)), ("subset", TTFont(io.BytesIO(subset_data)))):
+        _verify_fonts[key] = (font, font.getGlyphSet(), font.getBestCmap() or {})
+
+def _outline_hash(key, glyph_name):
+    """Hashes the advance width and decomposed outline of a glyph, independent of glyph names"""
+    font, glyph_set, _ = _verify_fonts[key]
+    width = glyph_set[glyph_name].width
+    if "glyf" in font:
+        # Stored coordinates with composites flattened. Drawing through the glyph set would
+        # also shift them by the hmtx lsb, which fontTools recalculates when saving.
+        glyf = font["glyf"]
+        coordinates, end_points, flags = glyf[glyph_name].getCoordinates(glyf)
+        outline = (list(coordinates), end_points, [flag & 1 for flag in flags])
+    else:
+        pen = DecomposingRecordingPen(glyph_set)
+        glyph_set[glyph_name].draw(pen)
+        outline = pen.value
+    return hashlib.sha1(repr((width, outline)).encode("utf-8")).hexdigest()
+
+def _verify_codepoint_chunk(codepoints):
+    """Returns (missing, altered) codepoints of the chunk"""
+    original_cmap = _verify_fonts["original"][2]
+    subset_cmap = _verify_fonts["subset"][2]
+    missing, altered = [], []
+    for cp in codepoints:
+        if cp not in subset_cmap:
+            missing.append(cp)
+        elif _outline_hash("original", original_cmap[cp]) != _outline_hash("subset", subset_cmap[cp]):
+            altered.append(cp)
+    return missing, altered
+
+def _hash_glyph_chunk(key, glyph_names):
+    return {name: _outline_hash(key, name) for name in glyph_names}
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def verify_subset(original_path, subset_data, codepoints, max_workers=None):
+    """
+    Checks every requested codepoint of the original font maps to an identical
+    outline in the subset, and that GSUB alternates reachable from them survived.
+    Work is split into chunks across worker processes.
+    Returns {'checked', 'missing', 'altered', 'missing_alternates'}.
+    """
+    original = TTFont(original_path, lazy=True)
+    original_cmap = original.getBestCmap() or {}
+    codepoints = sorted(cp for cp in set(codepoints) if cp in original_cmap)
+    alternates = sorted(gsub_alternates(original, {original_cmap[cp] for cp in codepoints},
+                                        set(Options().layout_features)))
+    subset_glyphs = TTFont(io.BytesIO(subset_data), lazy=True).getGlyphOrder()
+    original.close()
+    
+    workers = max_workers or os.cpu_count() or 1
+    chunk_size = max(256, -(-len(codepoints) // (workers * 4)))
+    missing, altered = [], []
+    if len(codepoints) + len(alternates) + len(subset_glyphs) <= chunk_size:
+        # A single chunk isn't worth starting worker processes for
+        _init_verify_worker(original_path, subset_data)
+        try:
+            missing, altered = _verify_codepoint_chunk(codepoints)
+            alternate_hashes = _hash_glyph_chunk("original", alternates)
+            subset_hashes = set(_hash_glyph_chunk("subset", subset_glyphs).values())
+        finally:
+            _verify_fonts.clear()
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_verify_worker,
+                                 initargs=(original_path, subset_data)) as executor:
+            codepoint_futures = [executor.submit(_verify_codepoint_chunk, chunk)
+                                 for chunk in _chunks(codepoints, chunk_size)]
+            alternate_futures = [executor.submit(_hash_glyph_chunk, "original", chunk)
+                                 for chunk in _chunks(alternates, chunk_size)]
+            subset_futures = [executor.submit(_hash_glyph_chunk, "subset", chunk)
+                              for chunk in _chunks(subset_glyphs, chunk_size)]
+            for future in codepoint_futures:
+                chunk_missing, chunk_altered = future.result()
+                missing.extend(chunk_missing)
+                altered.extend(chunk_altered)
+            alternate_hashes = {}
+            for future in alternate_futures:
+                alternate_hashes.update(future.result())
+            subset_hashes = set()
+            for future in subset_futures:
+                subset_hashes.update(future.result().values())
+    
+    # Alternates have no codepoint, so they're matched by outline across the whole subset
+    missing_alternates = [name for name in alternates if alternate_hashes[name] not in subset_hashes]
+    return {
+        'checked': len(codepoints),
+        'missing': missing,
+        'altered': altered,
+        'missing_alternates': missing_alternates
+    }
+
+# Text of the font size samples on the preview page
+PREVIEW_SIZE_TEXT = "12px: 16px: 24px: 36px: 你好世界 Hello World 0123456789"
+
+# Loads the faces marked with data-font-family through the Font Loading API and
+# shows the measured time next to the file size; <details> cards load on first expand.
+# Each load gets its own query string so faces sharing a file aren't timed from the HTTP cache.
+LAZY_FONT_SCRIPT = """
+<script>
+    var fontLoads = {};
+    
+    function showTiming(id, text) {
+        var cell = document.getElementById(id);
+        if (cell) {
+            cell.textContent = text;
+        }
+    }
+    
+    function loadFace(el) {
+        var family = el.dataset.fontFamily;
+        if (fontLoads[family]) {
+            return;
+        }
+        var token = Date.now() + '-' + Object.keys(fontLoads).length;
+        var src = el.dataset.fontSrc.replace(/url\\('([^']+)'\\)/g, "url('$1?nocache=" + token + "')");
+        var started = performance.now();
+        fontLoads[family] = new FontFace(family, src).load().then(function (face) {
+            document.fonts.add(face);
+            showTiming(el.dataset.timingId, (performance.now() - started).toFixed(1) + ' ms');
+        }, function () {
+            showTiming(el.dataset.timingId, '加载失败');
+        });
+    }
+    
+    document.querySelectorAll('[data-font-family]').forEach(function (el) {
+        if (el.tagName === 'DETAILS') {
+            el.addEventListener('toggle', function () {
+                if (el.open) {
+                    loadFace(el);
+                }
+            });
+        } else {
+            loadFace(el);
+        }
+    });
+</script>
+"""
 
 class FontConverterThread(QThread):
     progress_update = pyqtSignal(int)
     # Signal to emit log messages with a level (INFO, ERROR, WARN)
     log_update = pyqtSignal(str, str)
     completed = pyqtSignal(bool, str)
+    coverage_warning = pyqtSignal(object)
 
     """
     input_font_path: Path to the source font file
-    url_text: URL for the list of common characters
+    url_text: URLs / file paths of character lists, separated by ';' 
     custom_text: Custom characters
     output_formats: List of formats to output
+    inline_critical: Also emit a tiny critical subset inlined into the CSS as a data URI
+    critical_text: Above-the-fold text for the critical subset, empty to use the top characters of the list
+    rank_by_frequency: Treat the source text as a corpus and rank characters by frequency
+    budget_bytes: Target WOFF2 size; keeps the largest prefix of the ranked list that fits, None for no limit
+    verify: Compare the outline of every requested glyph in the subset against the original
+    lightweight_preview: Preview with a sample subset of the original and load each format on demand
+    coverage_index: FontCoverageIndex to check the requested characters against; when some are
+                    missing the run pauses on coverage_warning until resolve_coverage() is called
     """
     
-    def __init__(self, input_font_path, url_text, custom_text, output_formats):
+    def __init__(self, input_font_path, url_text, custom_text, output_formats, inline_critical=False, critical_text="",
+                 rank_by_frequency=False, budget_bytes=None, verify=True, lightweight_preview=True,
+                 coverage_index=None):
         super().__init__()
         self.input_font_path = input_font_path
         self.url_text = url_text
         self.custom_text = custom_text
         self.output_formats = output_formats
+        self.inline_critical = inline_critical
+        self.critical_text = critical_text
+        self.rank_by_frequency = rank_by_frequency
+        self.budget_bytes = budget_bytes
+        self.verify = verify
+        self.lightweight_preview = lightweight_preview
+        self.coverage_index = coverage_index
+        self.coverage_decision = threading.Event()
+        self.coverage_accepted = False
         
     def run(self):
+        executor = ThreadPoolExecutor(max_workers=8)
         try:
+            # Character sources download while the font loads
+            sources = parse_character_sources(self.url_text)
+            if sources:
+                self.log_update.emit(f"获取 {len(sources)} 个字符来源...", "INFO")
+            source_futures = [(source, executor.submit(fetch_character_source, source)) for source in sources]
+            # The selected font's index entry is refreshed alongside, it's needed once the characters are known
+            index_future = None
+            if self.coverage_index:
+                index_future = executor.submit(self.coverage_index.update, [self.input_font_path])
+            
             self.log_update.emit("加载字体文件...", "INFO")
             self.progress_update.emit(5)
             
@@ -60,18 +732,19 @@ class FontConverterThread(QThread):
             self.progress_update.emit(10)
             
             url_content = ""
-            if self.url_text:
-                self.log_update.emit("从URL下载字符...", "INFO")
-                try:
-                    response = requests.get(self.url_text, timeout=10)
-                    response.raise_for_status()
-                    url_content = response.text
-                    self.log_update.emit(f"从URL下载了 {len(url_content)} 个字符", "INFO")
-                except Exception as e:
-                    self.log_update.emit(f"从URL下载失败: {str(e)}", "ERROR")
+            if source_futures:
+                url_content = rank_characters(self.collect_sources(source_futures), self.rank_by_frequency)
+                self.log_update.emit(f"字符来源合计 {len(url_content)} 个不同字符", "INFO")
             self.progress_update.emit(20)
             
-            final_text = url_content + self.custom_text
+            # The critical text must also be part of the full subset that swaps in later
+            pinned_text = self.custom_text + (self.critical_text if self.inline_critical else "")
+            if not self.check_coverage(font, url_content + pinned_text, index_future, source_futures):
+                self.completed.emit(False, "已取消")
+                return
+            if self.budget_bytes and url_content:
+                url_content = self.fit_budget(font, url_content, pinned_text)
+            final_text = url_content + pinned_text
             if not final_text:
                 self.log_update.emit("警告: 没有提供字符用于子集化", "WARN")
                 final_text = None
@@ -104,90 +777,90 @@ class FontConverterThread(QThread):
                 "EOT": ".eot"
             }
             
-            # First, create a TTF version for subsequent conversions
-            ttf_base_path = os.path.join(result_dir, f"{base_filename}-subset.ttf")
-            font.save(ttf_base_path)
-            saved_files = []
-            self.log_update.emit(f"保存基础TTF格式...", "INFO")
+            # Serialize a plain TTF once, every other format is converted from these bytes
+            self.log_update.emit("生成基础TTF格式...", "INFO")
+            ttf_data = font_to_bytes(font)
+            codepoint_count = len(font.getBestCmap() or {})
             self.progress_update.emit(45)
             
             total_formats = len(self.output_formats)
             progress_per_format = 50 / total_formats if total_formats > 0 else 50 # Remaining 50% of progress is allocated to save operations
             
-            # First save the basic TTF format, then convert to other formats
-            ttf_output_path = os.path.join(result_dir, f"{base_filename}-subset.ttf")
-            # Clear any existing flavor first
-            if hasattr(font, 'flavor'):
-                font.flavor = None
-            font.save(ttf_output_path)
-            
-            # If TTF is in the output format list, add it to the saved files list
-            if "TTF" in self.output_formats:
-                saved_files.append(ttf_output_path)
-                self.log_update.emit(f"保存TTF格式完成", "INFO")
-            
-            # Save font file information for HTML generation
+            # Manifest entries for the files written in this run, also used for HTML/CSS generation
             font_files = []
             
-            # Process other formats
             for i, output_format in enumerate(self.output_formats):
-                # Add TTF to the font file list if it's a selected format
-                if output_format == "TTF":
-                    font_files.append({
-                        'format': 'TTF',
-                        'path': f"{base_filename}-subset.ttf",
-                        'rel_path': f"./{base_filename}-subset.ttf"
-                    })
-                    continue
-                    
                 current_format_progress = 50 + (i * progress_per_format)
                 self.log_update.emit(f"转换为 {output_format} 格式...", "INFO")
                 self.progress_update.emit(int(current_format_progress))
                 
-                output_filename = f"{base_filename}-subset{extension_map[output_format]}"
-                output_path = os.path.join(result_dir, output_filename)
-                
                 try:
-                    font_info_to_add = {
-                        'format': output_format,
-                        'path': output_filename,
-                        'rel_path': f"./{output_filename}"
-                    }
-                    if output_format == "OTF":
-                        # For OTF, save the TTF file as OTF
-                        otf_font = TTFont(ttf_output_path)
+                    if output_format == "TTF":
+                        data = ttf_data
+                    elif output_format == "OTF":
                         # Note: This just changes the extension, it doesn't truly convert the format.
                         # Actual OTF conversion might require more specialized processing.
-                        otf_font.save(output_path)
-                        saved_files.append(output_path)
-                        font_files.append(font_info_to_add)
+                        data = font_to_bytes(TTFont(io.BytesIO(ttf_data)))
                     elif output_format == "WOFF":
-                        # Load TTF and set flavor to woff
-                        woff_font = TTFont(ttf_output_path)
-                        woff_font.flavor = "woff"
-                        woff_font.save(output_path)
-                        saved_files.append(output_path)
-                        font_files.append(font_info_to_add)
+                        data = font_to_bytes(TTFont(io.BytesIO(ttf_data)), "woff")
                     elif output_format == "WOFF2":
-                        # Load TTF and set flavor to woff2
                         try:
-                            woff2_font = TTFont(ttf_output_path)
-                            woff2_font.flavor = "woff2"
-                            woff2_font.save(output_path)
-                            saved_files.append(output_path)
-                            font_files.append(font_info_to_add)
+                            data = font_to_bytes(TTFont(io.BytesIO(ttf_data)), "woff2")
                         except Exception as e:
                             self.log_update.emit(f"转换WOFF2格式失败: {str(e)}", "ERROR")
                             self.log_update.emit("WOFF2转换需要安装brotli模块，请运行: pip install brotli", "WARN")
+                            continue
                     elif output_format == "SVG":
                         self.log_update.emit(f"注意：暂不支持SVG格式，跳过。", "WARN")
+                        continue
                     elif output_format == "EOT":
                         self.log_update.emit(f"注意：EOT格式需要额外工具支持，如ttf2eot。此处跳过。", "WARN")
+                        continue
+                    else:
+                        continue
+                    
+                    logical_name = f"{base_filename}-subset{extension_map[output_format]}"
+                    output_filename = fingerprint_filename(logical_name, data)
+                    if write_atomic(os.path.join(result_dir, output_filename), data):
+                        self.log_update.emit(f"保存 {output_format} 格式完成: {output_filename}", "INFO")
+                    else:
+                        self.log_update.emit(f"{output_filename} 内容未变化，跳过写入", "INFO")
+                    font_files.append({
+                        'name': logical_name,
+                        'file': output_filename,
+                        'format': output_format,
+                        'size': len(data),
+                        'sha256': hashlib.sha256(data).hexdigest(),
+                        'codepoints': codepoint_count
+                    })
                 except Exception as e:
                     self.log_update.emit(f"转换 {output_format} 格式失败: {str(e)}", "ERROR")
                 
                 self.progress_update.emit(int(current_format_progress + progress_per_format / 2))
             
+            if self.verify and final_text:
+                self.verify_output(ttf_data, final_text)
+            
+            critical_font = None
+            if self.inline_critical and final_text:
+                critical_chars = self.critical_text or pick_critical_chars(font, final_text)
+                subset_codepoints = {cp for cp in font.getBestCmap() or {} if not chr(cp).isspace()}
+                if subset_codepoints <= {ord(c) for c in critical_chars}:
+                    # Inlining it all would only make the CSS carry the whole font a second time
+                    self.log_update.emit("关键字体已包含完整子集的全部字符，跳过内联关键字体", "WARN")
+                else:
+                    critical_font = self.build_critical_font(base_filename, critical_chars)
+                full_size = next((f['size'] for f in font_files if f['format'] == "WOFF2"), None)
+                if critical_font:
+                    self.log_update.emit(
+                        f"关键字体: {critical_font['codepoints']} 个字符, WOFF2 {format_size(critical_font['size'])}, "
+                        f"内联 base64 {format_size(critical_font['inline_size'])}", "INFO")
+                if full_size is not None:
+                    self.log_update.emit(f"完整字体: WOFF2 {format_size(full_size)} (font-display: swap 延迟加载)", "INFO")
+            
+            css_path = os.path.join(result_dir, f"{base_filename}.css")
+            write_atomic(css_path, self.generate_font_css(family_name, font_files, critical_font).encode("utf-8"))
+            
             # Prepare to generate HTML preview file
             self.log_update.emit("生成HTML预览文件...", "INFO")
             
@@ -202,6 +875,11 @@ class FontConverterThread(QThread):
             # Add some numbers and English characters for testing
             test_extra = "0123456789 abcdefghijklmnopqrstuvwxyz ABCDEFGHIJKLMNOPQRSTUVWXYZ"
             
+            original_sample = None
+            if self.lightweight_preview:
+                original_sample = self.build_original_sample(result_dir, base_filename,
+                                                             test_chars + test_extra + PREVIEW_SIZE_TEXT)
+            
             # Generate HTML file
             html_content = self.generate_html_preview(
                 family_name, 
@@ -210,17 +888,22 @@ class FontConverterThread(QThread):
                 original_font_rel_path,
                 font_files,
                 test_chars,
-                test_extra
+                test_extra,
+                critical_font,
+                original_sample
             )
             
             html_path = os.path.join(result_dir, "index.html")
-            with open(html_path, "w", encoding="utf-8") as f:
-                f.write(html_content)
+            write_atomic(html_path, html_content.encode("utf-8"))
+            
+            # Written last: the previous run's files are only pruned once everything new is in place
+            manifest_path = self.write_manifest(result_dir, font_files, critical_font, original_sample)
+            self.log_update.emit(f"已更新清单文件: {os.path.basename(manifest_path)}", "INFO")
             
             self.progress_update.emit(100)
             
-            if saved_files:
-                result_message = f"成功生成 {len(saved_files)} 个字体文件到 {result_dir}\n预览文件: {html_path}"
+            if font_files:
+                result_message = f"成功生成 {len(font_files)} 个字体文件到 {result_dir}\n预览文件: {html_path}\n清单文件: {manifest_path}"
                 self.completed.emit(True, result_message)
             else:
                 self.completed.emit(False, "没有成功生成任何字体文件")
@@ -228,87 +911,353 @@ class FontConverterThread(QThread):
         except Exception as e:
             self.log_update.emit(f"发生严重错误: {str(e)}", "ERROR")
             self.completed.emit(False, str(e))
+        finally:
+            executor.shutdown(wait=False)
+    
+    def verify_output(self, subset_data, text):
+        """Runs the verify stage on the subset and logs the findings"""
+        self.log_update.emit("校验子集字形...", "INFO")
+        started = time.perf_counter()
+        try:
+            report = verify_subset(self.input_font_path, subset_data, {ord(c) for c in text})
+        except Exception as e:
+            self.log_update.emit(f"子集校验失败: {str(e)}", "ERROR")
+            return
+        elapsed = time.perf_counter() - started
+        if report['missing']:
+            self.log_update.emit(f"校验: 子集缺少 {len(report['missing'])} 个字符: {format_codepoints(report['missing'])}", "ERROR")
+        if report['altered']:
+            self.log_update.emit(f"校验: {len(report['altered'])} 个字符的字形与原字体不一致: {format_codepoints(report['altered'])}", "ERROR")
+        if report['missing_alternates']:
+            names = ", ".join(report['missing_alternates'][:20])
+            self.log_update.emit(f"校验: 缺少 {len(report['missing_alternates'])} 个GSUB替代字形: {names}", "WARN")
+        if not (report['missing'] or report['altered'] or report['missing_alternates']):
+            self.log_update.emit(f"校验通过: {report['checked']} 个字符字形一致 (用时 {elapsed:.2f} 秒)", "INFO")
     
-    def generate_html_preview(self, family_name, full_name, original_font_filename, original_font_rel_path, font_files, test_chars, test_extra):
-        """Generates the HTML preview file"""
+    def check_coverage(self, font, text, index_future, source_futures):
+        """
+        Checks the requested characters against the selected font before anything is built.
+        When some are missing, emits coverage_warning and waits for resolve_coverage().
+        Returns False if the run should stop.
+        """
+        codepoints = {ord(c) for c in text if ord(c) >= 0x20 and not c.isspace()}
+        font_path = os.path.abspath(self.input_font_path)
+        report = {'missing': [], 'alternatives': [],
+                  'failed': [source for source, future in source_futures if future.exception()]}
+        try:
+            if index_future is None:
+                raise RuntimeError("未启用字体库索引")
+            index_future.result()
+            report['missing'] = self.coverage_index.missing_codepoints(codepoints, [font_path]).get(font_path, [])
+            if report['missing']:
+                # Whatever the library scan has indexed so far, it may still be running
+                report['alternatives'] = [p for p in self.coverage_index.fonts_covering(codepoints)
+                                          if os.path.dirname(p) == os.path.dirname(font_path)]
+        except Exception as e:
+            if index_future is not None:
+                self.log_update.emit(f"无法通过字体库索引检查字符覆盖: {str(e)}", "WARN")
+            report['missing'] = sorted(codepoints - set(font.getBestCmap() or {}))
+
+        if not report['missing']:
+            return True
+        self.log_update.emit(f"警告: 字体缺少 {len(report['missing'])} 个字符: "
+                             f"{format_codepoints(report['missing'])}", "WARN")
+        if not self.receivers(self.coverage_warning):
+            return True
+        self.coverage_warning.emit(report)
+        self.coverage_decision.wait()
+        return self.coverage_accepted
+
+    def resolve_coverage(self, accepted):
+        """Answers a coverage_warning, called from the GUI thread"""
+        self.coverage_accepted = accepted
+        self.coverage_decision.set()
+
+    def collect_sources(self, source_futures):
+        """Merges the fetched sources in the order they were given, logging per-source stats"""
+        merged = Counter()
+        for source, future in source_futures:
+            try:
+                counts, byte_count, elapsed = future.result()
+            except Exception as e:
+                self.log_update.emit(f"获取字符来源失败 {source}: {str(e)}", "ERROR")
+                continue
+            distinct = sum(1 for c in counts if not c.isspace())
+            self.log_update.emit(f"{source}: {byte_count} 字节, {distinct} 个不同字符, 用时 {elapsed:.2f} 秒", "INFO")
+            merged.update(counts)
+        return merged
+    
+    def fit_budget(self, font, ranked_chars, pinned_chars):
+        """
+        Returns the longest prefix of ranked_chars whose WOFF2 subset (together with
+        pinned_chars) fits in self.budget_bytes.
+
+        An estimate built from per-glyph compiled sizes, calibrated by two real
+        WOFF2 builds, picks the starting point; a few real builds around it then
+        pin down the exact boundary.
+        """
+        try:
+            import brotli
+        except ImportError:
+            self.log_update.emit("WOFF2转换需要安装brotli模块，请运行: pip install brotli", "WARN")
+            self.log_update.emit("跳过WOFF2大小预算筛选", "WARN")
+            return ranked_chars
         
-        # Create @font-face rules
-        font_face_css = ""
+        self.log_update.emit(f"按 {format_size(self.budget_bytes)} 预算筛选字符...", "INFO")
+        cmap = font.getBestCmap() or {}
+        ranked_chars = "".join(c for c in ranked_chars if ord(c) in cmap)
+        total = len(ranked_chars)
         
-        # @font-face for the original font
-        font_face_css += f"""
-@font-face {{
-    font-family: '{family_name}-original';
-    src: url('{original_font_rel_path}') format('truetype');
-    font-weight: normal;
-    font-style: normal;
-}}
-"""
+        # Cumulative raw size of every prefix; glyphs shared with earlier chars are counted once
+        seen = {".notdef"}
+        for c in pinned_chars:
+            if ord(c) in cmap:
+                seen.update(glyph_closure(font, cmap[ord(c)]))
+        raw_sizes = [0]
+        sample = []
+        for c in ranked_chars:
+            added = CODEPOINT_OVERHEAD_BYTES
+            for name in glyph_closure(font, cmap[ord(c)]):
+                if name not in seen:
+                    seen.add(name)
+                    data = glyph_compiled_data(font, name)
+                    added += len(data) + GLYPH_OVERHEAD_BYTES
+                    if len(sample) < 500:
+                        sample.append(data)
+            raw_sizes.append(raw_sizes[-1] + added)
+        
+        # The source font is parsed once: subsetting the candidate subset further gives
+        # the same bytes as subsetting the original, at a fraction of the parse cost
+        candidate_data = font_to_bytes(subset_font(self.input_font_path, pinned_chars + ranked_chars))
+        sizes = {}
         
-        # @font-face for subsetted fonts
-        format_to_mime = {
-            'TTF': 'truetype',
-            'OTF': 'opentype',
-            'WOFF': 'woff',
-            'WOFF2': 'woff2',
-            'SVG': 'svg',
-            'EOT': 'embedded-opentype'
+        def build(count):
+            if count not in sizes:
+                subset = subset_font(io.BytesIO(candidate_data), pinned_chars + ranked_chars[:count])
+                sizes[count] = len(font_to_bytes(subset, "woff2"))
+            return sizes[count]
+        
+        def fits(count):
+            return build(count) <= self.budget_bytes
+        
+        # Fixed cost: the pinned characters plus the tables every subset carries
+        overhead = build(0)
+        if overhead > self.budget_bytes:
+            self.log_update.emit(f"警告: 仅自定义字符就需要 {format_size(overhead)}，超出预算", "WARN")
+            return ""
+        
+        def estimate_count(ratio):
+            # Largest count whose estimated size fits
+            low, high = 0, total + 1
+            while high - low > 1:
+                mid = (low + high) // 2
+                if overhead + ratio * raw_sizes[mid] <= self.budget_bytes:
+                    low = mid
+                else:
+                    high = mid
+            return low
+        
+        # Compression ratio guessed from a sample of the glyph data, then calibrated by one real build
+        sample = b"".join(sample)
+        ratio = len(brotli.compress(sample, quality=5)) / len(sample) if sample else 0.5
+        count = estimate_count(ratio)
+        if raw_sizes[count]:
+            ratio = max(build(count) - overhead, 0) / raw_sizes[count]
+            count = estimate_count(ratio)
+        fits(count)
+        
+        # Pin down the real boundary between the tightest measured counts below and above
+        # the budget, interpolating on the raw sizes; bisect when that stops closing in
+        low, high = 0, total + 1
+        last_side = None
+        interpolate = True
+        while True:
+            for measured, size in sizes.items():
+                if size <= self.budget_bytes:
+                    low = max(low, measured)
+                else:
+                    high = min(high, measured)
+            if high - low <= 1:
+                break
+            probe = (low + high) // 2
+            if interpolate:
+                # Above the highest build only the calibrated ratio is known
+                slope = ratio if high > total else \
+                    (sizes[high] - sizes[low]) / max(raw_sizes[high] - raw_sizes[low], 1)
+                if slope > 0:
+                    target_raw = raw_sizes[low] + (self.budget_bytes - sizes[low]) / slope
+                    probe = bisect.bisect_right(raw_sizes, target_raw) - 1
+            probe = min(max(probe, low + 1), high - 1)
+            side = fits(probe)
+            # Landing on the same side twice means interpolation is creeping, bisect once
+            interpolate = side != last_side
+            last_side = side
+        
+        self.log_update.emit(f"预算内保留 {low}/{total} 个字符 (完整构建 {len(sizes)} 次)", "INFO")
+        return ranked_chars[:low]
+    
+    def build_original_sample(self, result_dir, base_filename, sample_text):
+        """
+        Subsets the original font to just the preview text, so the preview page can
+        show the original without downloading it. Returns its file info or None.
+        """
+        try:
+            sample = subset_font(self.input_font_path, sample_text)
+            try:
+                data, sample_format, ext = font_to_bytes(sample, "woff2"), "WOFF2", ".woff2"
+            except Exception:
+                # brotli missing, fall back to an uncompressed sample
+                data, sample_format, ext = font_to_bytes(sample), "TTF", ".ttf"
+        except Exception as e:
+            self.log_update.emit(f"生成原始字体预览样本失败: {str(e)}", "WARN")
+            return None
+        sample_filename = fingerprint_filename(f"{base_filename}-original-sample{ext}", data)
+        write_atomic(os.path.join(result_dir, sample_filename), data)
+        return {'file': sample_filename, 'format': sample_format, 'size': len(data)}
+    
+    def build_critical_font(self, base_filename, critical_chars):
+        """
+        Subsets the original font to critical_chars as WOFF2 and returns its inline data URI
+        together with the size report, or None if it couldn't be built.
+        """
+        try:
+            # Hinting is a large share of a tiny subset and the full font replaces it quickly
+            critical = subset_font(self.input_font_path, critical_chars, Options(hinting=False, desubroutinize=True))
+            data = font_to_bytes(critical, "woff2")
+        except Exception as e:
+            self.log_update.emit(f"生成关键字体失败: {str(e)}", "ERROR")
+            return None
+        data_uri = "data:font/woff2;base64," + base64.b64encode(data).decode("ascii")
+        return {
+            'name': f"{base_filename}-critical.woff2",
+            'chars': critical_chars,
+            'data_uri': data_uri,
+            'size': len(data),
+            'inline_size': len(data_uri),
+            'sha256': hashlib.sha256(data).hexdigest(),
+            'codepoints': len(critical.getBestCmap() or {})
         }
+    
+    def generate_html_preview(self, family_name, full_name, original_font_filename, original_font_rel_path, font_files, test_chars, test_extra, critical_font=None, original_sample=None):
+        """
+        Generates the HTML preview file.
+        With original_sample the page is lightweight: the original is shown through the
+        sample subset and the subsets are loaded by script, timed, on demand.
+        """
         
-        # Create a comprehensive @font-face including all formats
-        sources = []
-        for font_file in font_files:
-            src_format = format_to_mime.get(font_file['format'], 'truetype')
-            sources.append(f"url('{font_file['rel_path']}') format('{src_format}')")
+        # Create @font-face rules
+        font_face_css = ""
         
-        if sources:
-            combined_src = ",\n        ".join(sources)
-            font_face_css += f"""
-@font-face {{
-    font-family: '{family_name}-subset';
-    src: {combined_src};
-    font-weight: normal;
-    font-style: normal;
-}}
-"""
+        if original_sample:
+            # Faces are created by LAZY_FONT_SCRIPT from these attributes instead of @font-face
+            def lazy_font_attrs(family, files, timing_id):
+                src = ", ".join(f"url('./{f['file']}') format('{FORMAT_TO_MIME.get(f['format'], 'truetype')}')"
+                                for f in files)
+                return f'data-font-family="{family}" data-font-src="{src}" data-timing-id="{timing_id}"'
+            
+            original_attrs = lazy_font_attrs(f"{family_name}-original", [original_sample], "load-original")
+            subset_attrs = lazy_font_attrs(f"{family_name}-subset", sort_by_preference(font_files), "load-subset")
+        else:
+            original_attrs = subset_attrs = ""
+            
+            # @font-face for the original font
+            font_face_css += build_font_face(f"{family_name}-original", [(original_font_rel_path, 'TTF')])
+            
+            # Create a comprehensive @font-face including all formats
+            if font_files:
+                font_face_css += build_font_face(f"{family_name}-subset",
+                                                 [(f"./{f['file']}", f['format']) for f in font_files])
+            
+            # Create individual @font-face for each format
+            for font_file in font_files:
+                font_face_css += build_font_face(f"{family_name}-{font_file['format'].lower()}",
+                                                 [(f"./{font_file['file']}", font_file['format'])])
         
-        # Create individual @font-face for each format
-        for font_file in font_files:
-            font_format = font_file['format']
-            src_format = format_to_mime.get(font_format, 'truetype')
-            font_face_css += f"""
-@font-face {{
-    font-family: '{family_name}-{font_format.lower()}';
-    src: url('{font_file['rel_path']}') format('{src_format}');
-    font-weight: normal;
-    font-style: normal;
-}}
-"""
+        # Two-tier loading: the inlined critical subset renders first, the full subset swaps in
+        critical_card = ""
+        if critical_font:
+            font_face_css += build_font_face(f"{family_name}-critical", [(critical_font['data_uri'], 'WOFF2')])
+            woff2_files = [f for f in font_files if f['format'] == "WOFF2"]
+            if woff2_files:
+                font_face_css += build_font_face(f"{family_name}-deferred",
+                                                 [(f"./{woff2_files[0]['file']}", 'WOFF2')], display="swap")
+            critical_card = f"""
+        <div class="preview-card">
+            <h3>关键字体 (内联) + 完整字体 (swap)</h3>
+            <div class="text-preview preview-two-tier">
+                <p>{critical_font['chars'][:100]}</p>
+                <p>{test_chars}</p>
+            </div>
+        </div>"""
         
         # Generate font file size information
+        timing_header = "\n            <th>加载耗时</th>" if original_sample else ""
+        
+        def timing_cell(timing_id):
+            if not original_sample:
+                return ""
+            if not timing_id:
+                return "\n            <td>未加载</td>"
+            return f'\n            <td id="{timing_id}">-</td>'
+        
         font_size_info = f"""
 <section class="font-sizes">
     <h2>字体文件大小对比</h2>
     <table>
         <tr>
             <th>字体文件</th>
-            <th>大小</th>
+            <th>大小</th>{timing_header}
         </tr>
         <tr>
             <td>{original_font_filename} (原始)</td>
-            <td>{self.get_file_size(self.input_font_path)}</td>
+            <td>{self.get_file_size(self.input_font_path)}</td>{timing_cell("")}
         </tr>
 """
+        if original_sample:
+            font_size_info += f"""
+        <tr>
+            <td>{original_sample['file']} (原始字体预览样本)</td>
+            <td>{format_size(original_sample['size'])}</td>{timing_cell("load-original")}
+        </tr>"""
+        if original_sample and font_files:
+            font_size_info += f"""
+        <tr>
+            <td>瘦身包 (综合，浏览器自动选择格式)</td>
+            <td>-</td>{timing_cell("load-subset")}
+        </tr>"""
         for font_file in font_files:
-            file_path = os.path.join(os.path.dirname(self.input_font_path), "result", font_file['path'])
             font_size_info += f"""
         <tr>
-            <td>{font_file['path']} ({font_file['format']})</td>
-            <td>{self.get_file_size(file_path)}</td>
+            <td>{font_file['file']} ({font_file['format']})</td>
+            <td>{format_size(font_file['size'])}</td>{timing_cell(f"load-{font_file['format'].lower()}")}
         </tr>"""
         
         font_size_info += """
     </table>
+"""
+        if critical_font:
+            full_size = next((f['size'] for f in font_files if f['format'] == "WOFF2"), None)
+            font_size_info += f"""
+    <h3>两级加载</h3>
+    <table>
+        <tr>
+            <th>层级</th>
+            <th>字符数</th>
+            <th>大小</th>
+        </tr>
+        <tr>
+            <td>关键字体 (内联到CSS)</td>
+            <td>{critical_font['codepoints']}</td>
+            <td>{format_size(critical_font['size'])} (base64 {format_size(critical_font['inline_size'])})</td>
+        </tr>
+        <tr>
+            <td>完整字体 (WOFF2, font-display: swap)</td>
+            <td>{font_files[0]['codepoints'] if font_files else 0}</td>
+            <td>{format_size(full_size) if full_size is not None else "未生成"}</td>
+        </tr>
+    </table>
+"""
+        font_size_info += """
 </section>
 """
         
@@ -392,6 +1341,15 @@ class FontConverterThread(QThread):
             background: white;
         }}
         
+        details.preview-card summary {{
+            cursor: pointer;
+            font-weight: bold;
+        }}
+        
+        details.preview-card[open] summary {{
+            margin-bottom: 15px;
+        }}
+        
         .preview-card h3 {{
             margin-top: 0;
             border-bottom: 1px solid #eee;
@@ -428,6 +1386,10 @@ class FontConverterThread(QThread):
             font-family: '{family_name}-woff2', sans-serif;
         }}
         
+        .preview-two-tier {{
+            font-family: '{family_name}-deferred', '{family_name}-critical', sans-serif;
+        }}
+        
         .test-sizes {{
             margin: 20px 0;
         }}
@@ -481,7 +1443,7 @@ class FontConverterThread(QThread):
                 <p>{test_extra}</p>
             </div>
         </div>
-        <div class="preview-card">
+        <div class="preview-card" {original_attrs}>
             <h3>原始包</h3>
             <div class="text-preview preview-original">
                 <p>{test_chars}</p>
@@ -489,7 +1451,7 @@ class FontConverterThread(QThread):
             </div>
         </div>
         
-        <div class="preview-card">
+        <div class="preview-card" {subset_attrs}>
             <h3>瘦身包 (综合)</h3>
             <div class="text-preview preview-subset">
                 <p>{test_chars}</p>
@@ -501,6 +1463,16 @@ class FontConverterThread(QThread):
         # Add a preview card for each format
         for font_file in font_files:
             font_format = font_file['format'].lower()
+            if original_sample:
+                html += f"""
+        <details class="preview-card" {lazy_font_attrs(f"{family_name}-{font_format}", [font_file], f"load-{font_format}")}>
+            <summary>瘦身包 ({font_file['format']}) - 展开后加载</summary>
+            <div class="text-preview preview-{font_format}">
+                <p>{test_chars}</p>
+                <p>{test_extra}</p>
+            </div>
+        </details>"""
+                continue
             html += f"""
         <div class="preview-card">
             <h3>瘦身包 ({font_file['format']})</h3>
@@ -509,6 +1481,7 @@ class FontConverterThread(QThread):
                 <p>{test_extra}</p>
             </div>
         </div>"""
+        html += critical_card
         
         html += f"""
     </section>
@@ -536,21 +1509,99 @@ class FontConverterThread(QThread):
     <footer>
         <p>由字体瘦身工具生成 - 生成时间: {self.get_current_time()}</p>
     </footer>
+    {LAZY_FONT_SCRIPT if original_sample else ""}
 </body>
 </html>
 """
         return html
     
+    def write_manifest(self, result_dir, font_files, critical_font=None, original_sample=None):
+        """
+        Updates result/manifest.json, mapping logical names to the fingerprinted files.
+        Entries from other source fonts sharing the result directory are kept; files
+        this source's previous entries pointed to are deleted once no longer referenced.
+        """
+        manifest_path = os.path.join(result_dir, "manifest.json")
+        source = os.path.basename(self.input_font_path)
+        manifest = {}
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            pass
+        previous_files = {entry['file'] for section in ("files", "preview")
+                          for entry in manifest.get(section, {}).values()
+                          if entry.get("source") == source and entry.get("file")}
+        files = {name: entry for name, entry in manifest.get("files", {}).items()
+                 if entry.get("source") != source}
+        preview = {name: entry for name, entry in manifest.get("preview", {}).items()
+                   if entry.get("source") != source}
+        if original_sample:
+            # Only used by index.html, listed so it gets pruned like the fonts
+            base_filename = os.path.splitext(source)[0]
+            preview[f"{base_filename}-original-sample{os.path.splitext(original_sample['file'])[1]}"] = {
+                'file': original_sample['file'],
+                'source': source,
+                'format': original_sample['format'],
+                'size': original_sample['size']
+            }
+        inline = {name: entry for name, entry in manifest.get("inline", {}).items()
+                  if entry.get("source") != source}
+        if critical_font:
+            # Critical subsets live only inside the CSS, so they have no file
+            inline[critical_font['name']] = {
+                'source': source,
+                'format': 'WOFF2',
+                'size': critical_font['size'],
+                'inline_size': critical_font['inline_size'],
+                'sha256': critical_font['sha256'],
+                'codepoints': critical_font['codepoints']
+            }
+        for font_file in font_files:
+            files[font_file['name']] = {
+                'file': font_file['file'],
+                'source': source,
+                'format': font_file['format'],
+                'size': font_file['size'],
+                'sha256': font_file['sha256'],
+                'codepoints': font_file['codepoints']
+            }
+        manifest = {"generated": self.get_current_time(), "files": dict(sorted(files.items()))}
+        if inline:
+            manifest["inline"] = dict(sorted(inline.items()))
+        if preview:
+            manifest["preview"] = dict(sorted(preview.items()))
+        write_atomic(manifest_path, json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+        
+        referenced = {entry['file'] for section in ("files", "preview") for entry in manifest.get(section, {}).values()}
+        removed = 0
+        for stale_file in previous_files - referenced:
+            try:
+                os.remove(os.path.join(result_dir, stale_file))
+                removed += 1
+            except OSError:
+                pass
+        if removed:
+            self.log_update.emit(f"已删除 {removed} 个过期的输出文件", "INFO")
+        return manifest_path
+    
+    def generate_font_css(self, family_name, font_files, critical_font=None):
+        """Generates the deployable stylesheet referencing the fingerprinted files"""
+        ordered = sort_by_preference(font_files)
+        css = "/* Generated from manifest.json */\n"
+        if ordered:
+            css += build_font_face(family_name, [(f"./{f['file']}", f['format']) for f in ordered], display="swap")
+        if critical_font:
+            css += f"""
+/* Critical subset ({critical_font['codepoints']} chars), inlined so first paint needs no font request.
+   Use: font-family: '{family_name}', '{family_name}-critical', sans-serif; */"""
+            css += build_font_face(f"{family_name}-critical", [(critical_font['data_uri'], 'WOFF2')])
+        return css
+    
     def get_file_size(self, file_path):
         """Gets file size and formats it"""
         try:
-            size_bytes = os.path.getsize(file_path)
-            if size_bytes < 1024:
-                return f"{size_bytes} 字节"
-            elif size_bytes < 1024 * 1024:
-                return f"{size_bytes/1024:.2f} KB"
-            else:
-                return f"{size_bytes/(1024*1024):.2f} MB"
+            return format_size(os.path.getsize(file_path))
         except:
             return "未知"
     
@@ -559,6 +1610,25 @@ class FontConverterThread(QThread):
         from datetime import datetime
         return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
+class CoverageIndexThread(QThread):
+    """Refreshes the coverage index for a font library folder in the background"""
+    log_update = pyqtSignal(str, str)
+
+    def __init__(self, coverage_index, directory):
+        super().__init__()
+        self.coverage_index = coverage_index
+        self.directory = directory
+
+    def run(self):
+        try:
+            rebuilt, errors = self.coverage_index.update_directory(self.directory)
+            if rebuilt:
+                self.log_update.emit(f"字体库索引已更新: {rebuilt} 个字体", "INFO")
+            for path, error in errors.items():
+                self.log_update.emit(f"无法读取字体 {os.path.basename(path)}: {error}", "WARN")
+        except Exception as e:
+            self.log_update.emit(f"更新字体库索引失败: {str(e)}", "WARN")
+
 class FontConverterApp(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -593,11 +1663,25 @@ class FontConverterApp(QMainWindow):
         url_layout.addWidget(QLabel("常用字列表(3500常用字):"))
         self.url_input = QLineEdit()
         default_url = "https://raw.githubusercontent.com/shinchanZ/-3500-/master/3500"
-        self.url_input.setPlaceholderText(f"输入一个远程URL，例如{default_url}")
+        self.url_input.setPlaceholderText(f"输入远程URL或本地文件路径，多个用 ; 分隔，例如{default_url}")
         self.url_input.setText(default_url)
         url_layout.addWidget(self.url_input)
+        self.add_source_button = QPushButton("添加文件")
+        self.add_source_button.clicked.connect(self.browse_sources)
+        url_layout.addWidget(self.add_source_button)
         chars_layout.addLayout(url_layout)
         
+        budget_layout = QHBoxLayout()
+        self.rank_by_frequency_checkbox = QCheckBox("按字频排序 (URL内容为语料文本)")
+        self.rank_by_frequency_checkbox.setToolTip("统计URL文本中每个字符出现的次数，按频率从高到低排序")
+        budget_layout.addWidget(self.rank_by_frequency_checkbox)
+        budget_layout.addWidget(QLabel("WOFF2大小预算(KB):"))
+        self.budget_input = QLineEdit()
+        self.budget_input.setPlaceholderText("留空则不限制")
+        self.budget_input.setToolTip("按排序保留尽可能多的字符，使WOFF2文件不超过该大小；自定义字符始终保留")
+        budget_layout.addWidget(self.budget_input)
+        chars_layout.addLayout(budget_layout)
+        
         chars_layout.addWidget(QLabel("追加自定义字符:"))
         self.custom_chars = QTextEdit()
         example_chars = "犇骉淼焱"
@@ -639,7 +1723,27 @@ class FontConverterApp(QMainWindow):
         output_layout.addLayout(format_layout)
         output_layout.addLayout(format_group_layout)
         
+        critical_layout = QHBoxLayout()
+        self.inline_critical_checkbox = QCheckBox("内联关键字体 (首屏加速)")
+        self.inline_critical_checkbox.setToolTip("将首屏文字的极小子集以base64内联到CSS中，完整字体用 font-display: swap 延迟加载")
+        self.critical_text_input = QLineEdit()
+        self.critical_text_input.setPlaceholderText(f"首屏文字，留空则按字符列表顺序选取，字形约{CRITICAL_MAX_BYTES // 1024}KB为止")
+        critical_layout.addWidget(self.inline_critical_checkbox)
+        critical_layout.addWidget(self.critical_text_input, 1)
+        output_layout.addLayout(critical_layout)
+        
+        self.verify_checkbox = QCheckBox("校验子集字形")
+        self.verify_checkbox.setChecked(True)
+        self.verify_checkbox.setToolTip("逐字比对子集与原字体的字形轮廓，报告缺失或不一致的字形")
+        output_layout.addWidget(self.verify_checkbox)
+        
+        self.lightweight_preview_checkbox = QCheckBox("轻量预览 (不加载完整原始字体)")
+        self.lightweight_preview_checkbox.setChecked(True)
+        self.lightweight_preview_checkbox.setToolTip("预览页只加载原始字体中预览文字的小样本，各格式展开后才加载并显示加载耗时")
+        output_layout.addWidget(self.lightweight_preview_checkbox)
+        
         output_layout.addWidget(QLabel("所有文件将保存到源文件同级的 'result' 目录下"))
+        output_layout.addWidget(QLabel("文件名带内容哈希，可长期缓存；对应关系见 manifest.json 和生成的 CSS 文件"))
         
         # Add HTML preview file hint
         preview_html_label = QLabel("生成完成后，将在result目录生成index.html预览文件用于测试字体效果")
@@ -674,6 +1778,8 @@ class FontConverterApp(QMainWindow):
     
         self.input_font_path = ""
         self.converter_thread = None
+        self.coverage_index = FontCoverageIndex()
+        self.index_thread = None
         
     def browse_font(self):
         file_dialog = QFileDialog()
@@ -683,6 +1789,41 @@ class FontConverterApp(QMainWindow):
         if file_path:
             self.input_font_path = file_path
             self.input_font_label.setText(os.path.basename(file_path))
+            self.refresh_library_index()
+
+    def browse_sources(self):
+        file_paths, _ = QFileDialog.getOpenFileNames(
+            self, "选择字符列表文件", "", "文本文件 (*.txt);;所有文件 (*)"
+        )
+        if file_paths:
+            sources = parse_character_sources(self.url_input.text()) + file_paths
+            self.url_input.setText("; ".join(sources))
+    
+    def refresh_library_index(self):
+        """Indexes the fonts next to the selected one so coverage can be compared across the library"""
+        if self.index_thread and self.index_thread.isRunning():
+            return
+        self.index_thread = CoverageIndexThread(self.coverage_index, os.path.dirname(self.input_font_path))
+        self.index_thread.log_update.connect(self.append_to_log)
+        self.index_thread.start()
+
+    def confirm_coverage(self, report):
+        """Warns before a run when the selected font lacks some of the requested characters"""
+        missing = report['missing']
+        if not missing:
+            return True
+
+        message = f"所选字体缺少 {len(missing)} 个字符:\n{format_codepoints(missing)}"
+        if report['alternatives']:
+            names = ", ".join(os.path.basename(p) for p in report['alternatives'][:10])
+            message += f"\n\n字体库中完整覆盖这些字符的字体: {names}"
+        if self.index_thread and self.index_thread.isRunning():
+            message += "\n\n字体库索引仍在更新，以上列表可能不完整"
+        if report['failed']:
+            message += f"\n\n以下字符来源获取失败，未参与检查: {'; '.join(report['failed'])}"
+        reply = QMessageBox.warning(self, "字符覆盖提示", message + "\n\n是否继续?",
+                                    QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        return reply == QMessageBox.Yes
     
     def start_conversion(self):
         if not self.input_font_path:
@@ -698,27 +1839,49 @@ class FontConverterApp(QMainWindow):
             QMessageBox.warning(self, "提示", "请至少选择一种输出格式。")
             return
             
+        url_text = self.url_input.text().strip()
+        custom_text = self.custom_chars.toPlainText()
+        
+        budget_bytes = None
+        budget_text = self.budget_input.text().strip()
+        if budget_text:
+            try:
+                budget_bytes = int(float(budget_text) * 1024)
+            except ValueError:
+                budget_bytes = 0
+            if budget_bytes <= 0:
+                QMessageBox.warning(self, "提示", "WOFF2大小预算需为正数 (KB)。")
+                return
+
         self.progress_bar.setValue(0)
         self.log_output.clear() # Clear log on new run
         self.append_to_log("开始处理...", "INFO")
         self.convert_button.setEnabled(False)
-        
-        url_text = self.url_input.text().strip()
-        custom_text = self.custom_chars.toPlainText()
 
         self.converter_thread = FontConverterThread(
             self.input_font_path, 
             url_text, 
             custom_text,
-            selected_formats
+            selected_formats,
+            self.inline_critical_checkbox.isChecked(),
+            self.critical_text_input.text().strip(),
+            self.rank_by_frequency_checkbox.isChecked(),
+            budget_bytes,
+            self.verify_checkbox.isChecked(),
+            self.lightweight_preview_checkbox.isChecked(),
+            self.coverage_index
         )
     
         self.converter_thread.progress_update.connect(self.update_progress)
         self.converter_thread.log_update.connect(self.append_to_log)
+        self.converter_thread.coverage_warning.connect(self.coverage_warning)
         self.converter_thread.completed.connect(self.conversion_completed)
         
         self.converter_thread.start()
     
+    def coverage_warning(self, report):
+        self.converter_thread.resolve_coverage(self.confirm_coverage(report))
+    
     def update_progress(self, value):
         self.progress_bar.setValue(value)
     
@@ -784,4 +1947,6 @@ def main():
     sys.exit(app.exec_())
 
 if __name__ == "__main__":
+    # Needed for the coverage index worker processes in the PyInstaller build
+    multiprocessing.freeze_support()
     main()